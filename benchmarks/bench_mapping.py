@@ -0,0 +1,100 @@
+"""
+Benchmark the compiled vendor mapping against the old per-record deepcopy mapping on large asset lists.
+
+python benchmarks/bench_mapping.py [asset counts ...]
+"""
+import os
+import sys
+import timeit
+from copy import deepcopy
+from xml.etree import ElementTree
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from fetch.mapping import compile_mapping, MappingError  # noqa: E402
+from vendor_mappings import ZONAR_MAPPING  # noqa: E402
+
+CONTEXT = {"customer_id": "cust1", "tenant_id": "00000000-0000-0000-0000-000000000001"}
+
+
+def make_asset(i):
+    if i % 10 == 7:
+        # mapped tags empty: sent as None, opstatus and status included
+        return f'<asset id="{i}"><vin/><name/><gps></gps><opstatus/><status/><fuel>Diesel</fuel></asset>'
+    if i % 10 == 9:
+        # mapped tags missing: None, opstatus and status left out
+        return f'<asset id="{i}"><fleet>{i % 7}</fleet><exsid>{i}</exsid></asset>'
+    return (f'<asset id="{i}"><fleet>{i % 7}</fleet><type>Bus</type><subtype/><gps>GPS{i}</gps>'
+            f'<vin>VIN{i:012d}</vin><name>LIC{i}</name><exsid>{i}</exsid><mfg>Blue Bird</mfg><year>2015</year>'
+            f'<fuel>Diesel</fuel><opstatus>active</opstatus><status>1</status><odometer>{i * 13}</odometer>'
+            f'<lastinspection/></asset>')
+
+
+def make_xml(count):
+    return f"<assetlist>{''.join(make_asset(i) for i in range(count))}</assetlist>"
+
+
+def legacy_records(xml, customer_id, tenant_id):
+    """ the hard coded mapping make_vehicle used before the mapping specs"""
+    vehicle = {
+        "vin": None, "licensenumber": None, "busNumber": None, "deviceId": None, "manufacturer": None,
+        "model": "unknown", "tenantId": None, "assetId": None, "customerId": None, "deviceModel": "zonar",
+        "deviceBrand": "zonar", "RecordStatus": None
+    }
+    zonar_mapping = {"vin": "vin", "name": "licensenumber", "exsid": "busNumber", "mfg": "manufacturer",
+                     "opstatus": "status", "gps": "deviceId", "status": "zonarRecordStatus"}
+
+    assets = ElementTree.fromstring(xml)
+    if assets.tag == "assetlist":
+        for asset in assets:
+            curr = deepcopy(vehicle)
+            curr["assetId"] = asset.attrib["id"]
+            curr["customerId"] = customer_id
+            curr["tenantId"] = tenant_id
+            for elem in asset:
+                if elem.tag in zonar_mapping:
+                    curr[zonar_mapping[elem.tag]] = elem.text
+            yield curr
+
+
+def check_equivalence(mapping):
+    """ same records as the old code, including sparse assets, and an asset without id halts both"""
+    xml = make_xml(100)
+    assert list(mapping.records(xml, CONTEXT)) == \
+        list(legacy_records(xml, CONTEXT["customer_id"], CONTEXT["tenant_id"]))
+
+    xml = f"<assetlist>{make_asset(1)}<asset><vin>VIN</vin></asset></assetlist>"
+    for records, error in ((lambda: list(mapping.records(xml, CONTEXT)), MappingError),
+                           (lambda: list(legacy_records(xml, CONTEXT["customer_id"], CONTEXT["tenant_id"])), KeyError)):
+        try:
+            records()
+        except error:
+            pass
+        else:
+            raise AssertionError("an asset without id must halt the mapping")
+
+
+def main(counts):
+    mapping = compile_mapping(ZONAR_MAPPING)
+    check_equivalence(mapping)
+    for count in counts:
+        xml = make_xml(count)
+        root = ElementTree.fromstring(xml)
+        assert list(mapping.records(xml, CONTEXT)) == \
+            list(legacy_records(xml, CONTEXT["customer_id"], CONTEXT["tenant_id"]))
+
+        number = max(1, 20000 // count)
+        legacy = min(timeit.repeat(lambda: list(legacy_records(xml, CONTEXT["customer_id"], CONTEXT["tenant_id"])),
+                                   number=number, repeat=3)) / number
+        compiled = min(timeit.repeat(lambda: list(mapping.records(xml, CONTEXT)), number=number, repeat=3)) / number
+        # mapping only, without the xml parse both share
+        map_only = min(timeit.repeat(lambda: [mapping.record(asset, CONTEXT) for asset in root],
+                                     number=number, repeat=3)) / number
+
+        print(f"{count:>8} assets  legacy {legacy * 1000:9.2f} ms  compiled {compiled * 1000:9.2f} ms  "
+              f"({legacy / compiled:4.1f}x)  mapping only {map_only * 1000:9.2f} ms  "
+              f"{map_only / count * 1e6:5.2f} us/asset")
+
+
+if __name__ == '__main__':
+    main([int(count) for count in sys.argv[1:]] or [1000, 10000, 100000])
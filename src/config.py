@@ -2,14 +2,17 @@ from copy import deepcopy
 
 from fetch import BaseConfig
 from fetch.connectors.elasticsearch import build_es_config
-from fetch.connectors.eureka import build_eureka_config, register_eureka
+from fetch.connectors.eureka import build_eureka_config, register_eureka, build_discovery_config
 from fetch.fetch_config import build_gateway, build_auth_config
+from fetch.profiling import build_profile_config
+from fetch.work_queue import build_work_queue_config
 
 
 class Config(BaseConfig):
     APP_NAME = "VehicleFetch"
 
-    def __init__(self):
+    def __init__(self, register=True):
+        """ register False keeps processes that serve no http, like worker.py, out of eureka"""
         super().__init__()
 
         self.eureka_config = build_eureka_config(
@@ -17,7 +20,7 @@ class Config(BaseConfig):
             hostname=f"{self.v['eureka.hostname']}",
             service_port=self.v["eureka.service_port"],
         )
-        self.eureka_service = register_eureka(self.eureka_config)
+        self.eureka_service = register_eureka(self.eureka_config) if register else None
 
         self.auth_config = build_auth_config(
             application_name=self.APP_NAME,
@@ -36,6 +39,28 @@ class Config(BaseConfig):
             username=self.v['elastic_search.username']
         )
 
+        # with the work queue enabled the api only queues imports, worker.py processes run them
+        self.work_queue_config = build_work_queue_config(
+            enabled=self.v.get("app_config.work_queue_enabled", "false").lower() == "true",
+            lease_seconds=int(self.v.get("app_config.work_queue_lease_seconds", 60)),
+            poll_interval=int(self.v.get("app_config.work_queue_poll_interval", 5)),
+            concurrency=int(self.v.get("app_config.work_queue_concurrency", 1)),
+            max_attempts=int(self.v.get("app_config.work_queue_max_attempts", 3))
+        )
+
+        # profile requests go through the status doc, results to the profile index, shared by every process
+        profile_es_config = deepcopy(self.base_es_config)
+        profile_es_config["index"] = self.v.get("elastic_search.profile_index",
+                                                f"{self.v['elastic_search.status_index']}_profile")
+        self.profile_config = build_profile_config(
+            status_es_config=self.base_es_config,
+            profile_es_config=profile_es_config,
+            poll_interval=int(self.v.get("app_config.profile_poll_interval", 5)),
+            max_duration=int(self.v.get("app_config.profile_max_duration", 300)),
+            slow_callback_ms=int(self.v.get("app_config.profile_slow_callback_ms", 50)),
+            retention_days=int(self.v.get("app_config.profile_retention_days", 7))
+        )
+
         self.es_raw_config = deepcopy(self.base_es_config)
         self.es_raw_config["index"] = self.v["elastic_search.raw_index"]
 
@@ -48,6 +73,17 @@ class Config(BaseConfig):
             }
         )
 
+        # direct calls to vehicleQueryWSAPI instances, the gateway above is the fallback
+        self.vehicle_query_wsapi_discovery_config = build_discovery_config(
+            enabled=self.v.get("app_config.discovery_enabled", "false").lower() == "true",
+            eureka_server=self.v["eureka.hostname"],
+            application_name=self.v.get("vehicle_query_wsapi.app_name", "VEHICLEQUERYWSAPI"),
+            service_slug="api/v4.0/vehicles/assetId",
+            refresh_interval=int(self.v.get("vehicle_query_wsapi.refresh_interval", 30)),
+            max_failures=int(self.v.get("vehicle_query_wsapi.max_failures", 3)),
+            eject_seconds=int(self.v.get("vehicle_query_wsapi.eject_seconds", 30))
+        )
+
         self.tenant_service_config = build_gateway(
             gateway_url=f"{self.v['gateway.url']}/api/v2.0/tenants/",
             header={
@@ -1,5 +1,6 @@
 from .fetch_config import BaseConfig
 from .import_cycle import ImportCycle
-from .setup import flask_setup, run_cycle, run_cycle_async
+from .setup import flask_setup, worker_setup, run_cycle, run_cycle_async
+from .work_queue import WorkQueue
 
-__all__ = ["flask_setup", "BaseConfig", "ImportCycle", "run_cycle", "run_cycle_async"]
+__all__ = ["flask_setup", "worker_setup", "BaseConfig", "ImportCycle", "run_cycle", "run_cycle_async", "WorkQueue"]
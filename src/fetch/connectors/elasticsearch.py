@@ -39,23 +39,27 @@ class ElasticSearch:
                                  ca_certs=certifi.where())
 
     def get(self, id_):
+        """ None if the doc does not exist, other errors are raised"""
+        logger.debug(f"get {id_}, {self.index}")
         try:
-            logger.debug(f"get {id_}, {self.index}")
             result = self.conn.get(index=self.index, id=id_, doc_type="_doc")
-            logger.debug(result)
         except NotFoundError:
-            result = None
-        finally:
-            return result
+            return None
+        logger.debug(result)
+        return result
 
     def insert(self, data, id_):
         logger.debug(f"insert {data}, {id_}, {self.index}")
         result = self.conn.create(index=self.index, id=id_, doc_type="_doc", body=data)
         logger.debug(result)
 
-    def update(self, data, id_):
+    def update(self, data, id_, seq_no=None, primary_term=None):
+        """ with seq_no and primary_term the update only applies if the doc is unchanged, else ConflictError"""
         logger.debug(f"update {data}, {id_}, {self.index}")
-        result = self.conn.update(index=self.index, id=id_, doc_type="_doc", body={"doc": data})
+        kwargs = {}
+        if seq_no is not None:
+            kwargs = {"if_seq_no": seq_no, "if_primary_term": primary_term}
+        result = self.conn.update(index=self.index, id=id_, doc_type="_doc", body={"doc": data}, **kwargs)
         logger.debug(result)
 
     def delete(self, data, id_):
@@ -63,6 +67,11 @@ class ElasticSearch:
         result = self.conn.delete(index=self.index, id=id_, doc_type="_doc", body=data)
         logger.debug(result)
 
+    def delete_by_query(self, query):
+        logger.debug(f"delete_by_query {query}, {self.index}")
+        result = self.conn.delete_by_query(index=self.index, body=query)
+        logger.debug(result)
+
     def search(self, query):
         logger.debug(f"search {query}, {self.index}")
         result = self.conn.search(index=self.index, body=query)
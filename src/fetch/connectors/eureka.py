@@ -1,7 +1,15 @@
+import asyncio
+import logging
+import random
 import socket
+import threading
+import time
 
+import aiohttp
 from py_eureka_client import eureka_client
 
+logger = logging.getLogger("flask.app.connector.eureka")
+
 
 def build_eureka_config(hostname, service_port, app_name):
     return {
@@ -47,3 +55,155 @@ def req_service(config, body):
         return_type="json",
         prefer_ip=True
     )
+
+
+def build_discovery_config(enabled, eureka_server, application_name, service_slug, refresh_interval, max_failures,
+                           eject_seconds):
+    return {
+        "enabled": enabled,
+        "eureka_server": eureka_server,
+        "application_name": application_name,
+        "service_slug": service_slug,
+        "refresh_interval": refresh_interval,
+        "max_failures": max_failures,
+        "eject_seconds": eject_seconds
+    }
+
+
+class ServiceInstance:
+
+    def __init__(self, url):
+        self.url = url
+        self.outstanding = 0
+        self.failures = 0
+        self.ejected_until = 0.0
+
+    def healthy(self, now):
+        return self.ejected_until <= now
+
+
+# application name -> DiscoveryClient, shared by every import in the process
+_discovery_clients = {}
+_discovery_lock = threading.Lock()
+
+
+def get_discovery_client(config):
+    """ the process wide client for config's application, started on first use"""
+    with _discovery_lock:
+        client = _discovery_clients.get(config["application_name"])
+        if client is None:
+            client = _discovery_clients[config["application_name"]] = DiscoveryClient(config)
+            client.start()
+        return client
+
+
+class DiscoveryClient:
+    """
+    Spread requests across the up instances of a eureka application.
+
+    The instance list is cached and refreshed by a background thread, requests go to the healthy instance with
+    the fewest outstanding requests, and an instance is ejected for a while after consecutive failures. The
+    instance state is shared by the imports of the process, each running its own event loop, so it is only
+    touched under a lock. When no instance is available, or discovery is disabled, the caller's fallback
+    (gateway) url is used.
+    """
+
+    # instances tried before the fallback url
+    ATTEMPTS = 2
+
+    def __init__(self, config):
+        self.config = config
+        self.instances = {}
+        self._lock = threading.Lock()
+
+    def start(self):
+        if self.config["enabled"]:
+            threading.Thread(target=self._refresh_loop, daemon=True).start()
+
+    def _refresh_loop(self):
+        while True:
+            self.refresh()
+            time.sleep(self.config["refresh_interval"])
+
+    def refresh(self):
+        """ pull the instance list from eureka, keep the state of instances we already know about"""
+        try:
+            applications = eureka_client.get_applications(self.config["eureka_server"])
+            application = applications.get_application(self.config["application_name"])
+            urls = [self._instance_url(instance) for instance in application.up_instances]
+        except Exception as e:
+            # keep serving from the cached list, an empty cache falls back to the gateway
+            logger.error(f"eureka refresh failed for {self.config['application_name']}: {repr(e)}")
+            return
+
+        with self._lock:
+            self.instances = {url: self.instances.get(url) or ServiceInstance(url) for url in urls}
+        logger.debug(f"{self.config['application_name']} instances: {urls}")
+
+    @staticmethod
+    def _instance_url(instance):
+        if instance.securePort.enabled:
+            return f"https://{instance.ipAddr}:{instance.securePort.port}"
+        return f"http://{instance.ipAddr}:{instance.port.port}"
+
+    def _acquire(self, exclude):
+        """ reserve the healthy instance, not in exclude, with the fewest outstanding requests"""
+        now = time.monotonic()
+        with self._lock:
+            healthy = [instance for instance in self.instances.values()
+                       if instance.healthy(now) and instance.url not in exclude]
+            if not healthy:
+                return None
+            # outstanding counts are per process, break ties at random so processes do not all pick the same one
+            random.shuffle(healthy)
+            instance = min(healthy, key=lambda instance_: instance_.outstanding)
+            instance.outstanding += 1
+            return instance
+
+    def _release(self, instance, ok):
+        """ ok None, the request was cancelled, does not count either way"""
+        with self._lock:
+            instance.outstanding -= 1
+            if ok is None:
+                return
+            if ok:
+                instance.failures = 0
+                return
+            instance.failures += 1
+            if instance.failures >= self.config["max_failures"]:
+                logger.warning(f"ejecting {instance.url} after {instance.failures} consecutive failures")
+                instance.ejected_until = time.monotonic() + self.config["eject_seconds"]
+                instance.failures = 0
+
+    async def request(self, session, method, fallback_url, **kwargs):
+        """
+        send the request to a healthy instance, on a connection error or 5xx response try the next one, then
+        fallback_url. return (url, status, body)
+        """
+        tried = set()
+        for _attempt in range(self.ATTEMPTS):
+            instance = self._acquire(tried)
+            if instance is None:
+                break
+            tried.add(instance.url)
+            url = f"{instance.url}/{self.config['service_slug']}"
+
+            ok = None
+            try:
+                async with session.request(method, url, **kwargs) as response:
+                    body = await response.text()
+                ok = response.status < 500
+            except (aiohttp.ClientError, OSError, asyncio.TimeoutError) as e:
+                ok = False
+                logger.warning(f"{method} {url} failed: {repr(e)}")
+                continue
+            finally:
+                self._release(instance, ok)
+
+            if ok:
+                return url, response.status, body
+            logger.warning(f"{method} {url} returned {response.status}: {body}")
+
+        logger.debug(f"no healthy {self.config['application_name']} instance left, using {fallback_url}")
+        async with session.request(method, fallback_url, **kwargs) as response:
+            return fallback_url, response.status, await response.text()
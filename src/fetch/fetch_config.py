@@ -30,7 +30,10 @@ class BaseConfig:
         "end_timestamp": "",
         "status": "",
         "notify": [],
-        "child_imports": []
+        "child_imports": [],
+        "worker_id": None,
+        "lease_expires": None,
+        "attempts": 0
     }
 
     NOTIFY_DOC = {
@@ -40,6 +43,7 @@ class BaseConfig:
     }
 
     base_es_config = None
+    profile_config = None
 
     v = None
 
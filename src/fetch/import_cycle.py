@@ -10,6 +10,7 @@ from uuid import uuid4
 
 from .connectors.elasticsearch import ElasticSearch
 from .fetch_config import BaseConfig
+from .profiling import watch_profile_requests
 
 logger = logging.getLogger("flask.app.fetch")
 
@@ -18,19 +19,31 @@ class FetchStatus(Enum):
     FAIL = -1
     RUNNING = 0
     SUCCESS = 1
+    QUEUED = 2
 
 
 class ImportCycle:
 
-    def __init__(self, import_type: str, tenant_id, config: BaseConfig, get, store, notify):
+    def __init__(self, import_type: str, tenant_id, config: BaseConfig, get, store, notify, status_doc=None):
+        """
+        status_doc is a queued import claimed from the work queue, the cycle reuses its fetch_id instead of
+        creating a new status doc
+        """
 
         self.config = config
         self.get = get
         self.store = store
         self.notify = notify
         self.es = ElasticSearch(config.base_es_config)
-        self.status_doc = deepcopy(config.STATUS_DOC)
-        self.fetch_id = self.status_doc["fetch_id"] = uuid4()
+        self.claimed = status_doc is not None
+        if self.claimed:
+            # a previous attempt may have been abandoned part way, start the import over
+            self.status_doc = {**deepcopy(config.STATUS_DOC), **status_doc,
+                               "total_records": 0, "error": "", "notify": [], "child_imports": []}
+            self.fetch_id = self.status_doc["fetch_id"]
+        else:
+            self.status_doc = deepcopy(config.STATUS_DOC)
+            self.fetch_id = self.status_doc["fetch_id"] = uuid4()
         self.status = self.status_doc["status"] = FetchStatus.RUNNING.name
         self.status_doc["tenant_id"] = self.tenant_id = tenant_id
         self.status_doc["import_type"] = import_type
@@ -40,25 +53,49 @@ class ImportCycle:
         """
         run the event loop, consume the get list and clean up
         """
-        self.es.insert(self.status_doc, self.status_doc["fetch_id"])
+        # pick up profile requests made through the api for this import
+        watcher = None
+        if self.config.profile_config is not None:
+            watcher = asyncio.get_event_loop().create_task(
+                watch_profile_requests(self.config.profile_config, self.fetch_id))
+        try:
+            return await self._run()
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+                await asyncio.wait({watcher})
+
+    async def _run(self):
+        if self.claimed:
+            self.es.update(self.status_doc, self.status_doc["fetch_id"])
+        else:
+            self.es.insert(self.status_doc, self.status_doc["fetch_id"])
 
         # downstream service cant handle a large number of connections, limit with this
         concurrent_count = int(self.config.v["app_config.concurrent_count"])
         dl_tasks = set()
         event_loop = asyncio.get_event_loop()
 
-        async for data, halt in self._get():
-            if data is None or halt:
-                raise Exception(f"get failed, halt, error: {data}")
-
-            if len(dl_tasks) >= concurrent_count:
-                # Wait for some download to finish before adding a new one
-                _done, dl_tasks = await asyncio.wait(dl_tasks, return_when=asyncio.FIRST_COMPLETED)
-
-            dl_tasks.add(event_loop.create_task(self._store(data)))
-
-        # Wait for the remaining downloads to finish
-        await asyncio.wait(dl_tasks)
+        try:
+            async for data, halt in self._get():
+                if data is None or halt:
+                    raise Exception(f"get failed, halt, error: {data}")
+
+                if len(dl_tasks) >= concurrent_count:
+                    # Wait for some download to finish before adding a new one
+                    _done, dl_tasks = await asyncio.wait(dl_tasks, return_when=asyncio.FIRST_COMPLETED)
+
+                dl_tasks.add(event_loop.create_task(self._store(data)))
+
+            # Wait for the remaining downloads to finish
+            await asyncio.wait(dl_tasks)
+        except asyncio.CancelledError:
+            # e.g. the work queue lease was lost, dont leave stores running on the caller's closed session
+            for task in dl_tasks:
+                task.cancel()
+            if dl_tasks:
+                await asyncio.wait(dl_tasks)
+            raise
 
         if self.status == FetchStatus.FAIL.name:
             logger.error(f"Import Failed, {self.status_doc}")
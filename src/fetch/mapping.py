@@ -0,0 +1,167 @@
+import logging
+from xml.etree import ElementTree
+
+logger = logging.getLogger("flask.app.mapping")
+
+
+class MappingError(Exception):
+    pass
+
+
+def _bool(value):
+    return value.strip().lower() in ("1", "true", "yes", "y")
+
+
+COERCIONS = {
+    "str": str,
+    "int": int,
+    "float": float,
+    "bool": _bool,
+    "strip": str.strip,
+    "upper": str.upper,
+    "lower": str.lower
+}
+
+FIELD_KEYS = {"tag", "attribute", "context", "default", "type", "optional", "required"}
+
+
+def compile_mapping(spec):
+    """
+    Compile a vendor mapping spec into a CompiledMapping.
+
+    spec = {
+        "root": tag of the document root, its children are the records,
+        "fields": {output key: {
+            "tag": child tag, or path below the record ("engine/hours"),
+            "attribute": attribute of the record, or of the tag element when tag is set,
+            "context": name of a value passed in with the document (tenant_id, ...),
+            "default": value when the source is missing or empty,
+            "type": coercion applied to found values, one of COERCIONS,
+            "optional": leave the key out of the record when the source is missing, an empty element is
+                        still sent as None,
+            "required": raise MappingError when the value is None, halting the import
+        }}
+    }
+    A field without tag, attribute or context is the constant default.
+
+    The spec is turned into the source of a record function specialised for it, one pass over the record's
+    children and a dict display with the output keys, and compiled once.
+    """
+    if "root" not in spec or "fields" not in spec:
+        raise MappingError(f"mapping spec needs root and fields, got {list(spec)}")
+
+    # spec values only reach the generated source through this namespace, never as literals
+    namespace = {"_coerce": _coerce, "MappingError": MappingError}
+    child_tags = []
+    lines = []
+    values = []
+    checks = []
+    optional = []
+    for i, (key, field) in enumerate(spec["fields"].items()):
+        _check_field(key, field)
+        namespace[f"k{i}"] = key
+        namespace[f"d{i}"] = field.get("default")
+        tag, attribute = field.get("tag"), field.get("attribute")
+
+        if "context" in field:
+            namespace[f"n{i}"] = field["context"]
+            lines.append(f"v{i} = context.get(n{i})")
+        elif tag is not None:
+            namespace[f"t{i}"] = tag
+            if "/" in tag:
+                lines.append(f"e = record.find(t{i})")
+            else:
+                child_tags.append(tag)
+                lines.append(f"e = children.get(t{i})")
+            if attribute is None and field.get("optional", False):
+                # an element that is present but empty counts as found
+                lines.append(f"p{i} = e is not None")
+            if attribute is None:
+                lines.append(f"v{i} = None if e is None else e.text")
+            else:
+                namespace[f"a{i}"] = attribute
+                lines.append(f"v{i} = None if e is None else e.get(a{i})")
+        elif attribute is not None:
+            namespace[f"a{i}"] = attribute
+            lines.append(f"v{i} = record.get(a{i})")
+        else:
+            # constant
+            values.append(f"k{i}: d{i}")
+            continue
+
+        if "type" in field:
+            namespace[f"f{i}"] = COERCIONS[field["type"]]
+            lines.append(f"v{i} = _coerce(v{i}, f{i}, d{i}, k{i})")
+        elif field.get("default") is not None:
+            lines.append(f"if v{i} is None or v{i} == '': v{i} = d{i}")
+
+        if field.get("required", False):
+            checks.append(f"if v{i} is None: raise MappingError(f'record {{record.attrib}}: {{k{i}}} is missing')")
+
+        if field.get("optional", False):
+            found = f"p{i}" if tag is not None and attribute is None else f"v{i} is not None"
+            optional.append(f"if {found}: result[k{i}] = v{i}")
+        else:
+            values.append(f"k{i}: v{i}")
+
+    source = ["def record(record, context):"]
+    if child_tags:
+        # one pass over the children, a repeated tag keeps the last element
+        source.append("    children = {child.tag: child for child in record}")
+    source += [f"    {line}" for line in lines + checks]
+    source.append(f"    result = {{{', '.join(values)}}}")
+    source += [f"    {line}" for line in optional]
+    source.append("    return result")
+    source = "\n".join(source)
+
+    logger.debug(f"compiled mapping for {spec['root']}:\n{source}")
+    exec(compile(source, f"<mapping {spec['root']}>", "exec"), namespace)
+    return CompiledMapping(spec["root"], namespace["record"], source)
+
+
+def _check_field(key, field):
+    unknown = set(field) - FIELD_KEYS
+    if unknown:
+        raise MappingError(f"field {key}: unknown keys {unknown}")
+    if "context" in field and ("tag" in field or "attribute" in field):
+        raise MappingError(f"field {key}: context can not be combined with tag or attribute")
+    if field.get("type", "str") not in COERCIONS:
+        raise MappingError(f"field {key}: unknown type {field['type']}, expected one of {list(COERCIONS)}")
+    if not {"tag", "attribute", "context"} & set(field):
+        for option in ("type", "optional", "required"):
+            if option in field:
+                raise MappingError(f"field {key}: {option} needs a tag, attribute or context, not a constant")
+    if field.get("required", False) and ("default" in field or field.get("optional", False)):
+        raise MappingError(f"field {key}: a required field can not have a default or be optional")
+
+
+def _coerce(value, coerce, default, key):
+    if value is None or value == "":
+        return value if default is None else default
+    try:
+        return coerce(value)
+    except (ValueError, TypeError, AttributeError):
+        # e.g. a string coercion on a non string context value
+        logger.debug(f"field {key}: can not coerce {value!r}, using {default!r}")
+        return default
+
+
+class CompiledMapping:
+    """
+    Extractor built once from a mapping spec, maps each record element straight into an output dict.
+    """
+
+    def __init__(self, root, record, source):
+        self.root = root
+        self.record = record
+        self.source = source
+
+    def records(self, xml, context):
+        """ yield a record per child of the document root, nothing if the root tag does not match"""
+        root = ElementTree.fromstring(xml)
+        if root.tag != self.root:
+            logger.debug(f"expected root {self.root}, got {root.tag}")
+            return
+        record = self.record
+        for elem in root:
+            yield record(elem, context)
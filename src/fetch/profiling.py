@@ -0,0 +1,314 @@
+import asyncio
+import logging
+import math
+import os
+import socket
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+from .connectors.elasticsearch import ElasticSearch
+
+logger = logging.getLogger("flask.app.profiling")
+
+# never sample faster than this, the sampler holds the GIL while it walks the stacks
+MIN_INTERVAL = 0.001
+
+
+class ProfileError(Exception):
+    pass
+
+
+def build_profile_config(status_es_config, profile_es_config, poll_interval, max_duration, slow_callback_ms,
+                         retention_days):
+    return {
+        "status_es_config": status_es_config,
+        "profile_es_config": profile_es_config,
+        "poll_interval": poll_interval,
+        "max_duration": max_duration,
+        "slow_callback_ms": slow_callback_ms,
+        "retention_days": retention_days
+    }
+
+
+def request_profile(config, fetch_id, duration, interval):
+    """
+    Ask the process running the import to profile it, whichever process that is (api thread or work queue worker).
+
+    The request is a REQUESTED doc keyed by the returned profile_id in the profile index, the import's process
+    polls for it and writes the results back to it. The status doc is left alone, work queue workers update it
+    under their lease. Raises ProfileError for bad arguments or an import that can not be profiled.
+    """
+    if not math.isfinite(duration) or duration <= 0:
+        raise ProfileError(f"duration must be a positive number of seconds, got {duration}")
+    if not math.isfinite(interval) or interval < 0:
+        raise ProfileError(f"interval must be a positive number of seconds, got {interval}")
+    duration = min(duration, config["max_duration"])
+    interval = max(interval, MIN_INTERVAL)
+
+    result = ElasticSearch(config["status_es_config"]).get(fetch_id)
+    if result is None or result["found"] is not True:
+        raise ProfileError(f"fetch_id {fetch_id} not found")
+    if result["_source"]["status"] != "RUNNING":
+        raise ProfileError(f"fetch_id {fetch_id} is {result['_source']['status']}, not RUNNING")
+
+    profile_es = ElasticSearch(config["profile_es_config"])
+    pending = profile_es.search(_profiles_query(fetch_id, ["REQUESTED", "RUNNING"]))["hits"]["hits"]
+    if pending:
+        raise ProfileError(f"fetch_id {fetch_id} already has profile {pending[0]['_id']} "
+                           f"{pending[0]['_source']['state']}")
+
+    evict_profiles(config)
+
+    now = datetime.utcnow()
+    profile_id = uuid4()
+    profile_es.insert({
+        "profile_id": profile_id,
+        "fetch_id": fetch_id,
+        "state": "REQUESTED",
+        "requested_timestamp": now.isoformat(timespec='seconds'),
+        # a request nobody picked up in time is stale, e.g. for an import that died
+        "expires": (now + timedelta(seconds=duration + 2 * config["poll_interval"])).isoformat(timespec='seconds'),
+        "duration": duration,
+        "interval": interval
+    }, profile_id)
+    return profile_id
+
+
+def _profiles_query(fetch_id, states):
+    """ unexpired profiles of fetch_id in one of states"""
+    return {
+        "size": 10,
+        "query": {"bool": {
+            "filter": [{"match_phrase": {"fetch_id": str(fetch_id)}},
+                       {"range": {"expires": {"gt": "now"}}}],
+            "should": [{"match": {"state": state}} for state in states],
+            "minimum_should_match": 1
+        }}
+    }
+
+
+def get_profile(config, profile_id):
+    result = ElasticSearch(config["profile_es_config"]).get(profile_id)
+    if result is None or result["found"] is not True:
+        return None
+    return result["_source"]
+
+
+def evict_profiles(config):
+    """ drop profiles requested more than retention_days ago"""
+    try:
+        ElasticSearch(config["profile_es_config"]).delete_by_query({"query": {"range": {
+            "requested_timestamp": {"lt": f"now-{config['retention_days']}d"}}}})
+    except Exception as e:
+        logger.error(f"profile eviction failed: {repr(e)}")
+
+
+# event loop -> fetch_ids of the imports running in it, a work queue worker runs several in one loop
+_loop_imports = {}
+# event loop -> [profile sessions, debug, slow_callback_duration before the first session]
+_instrumented = {}
+_lock = threading.Lock()
+
+
+def _call_in_loop(loop, callback, *args):
+    """ False if the loop closed in the meantime"""
+    try:
+        loop.call_soon_threadsafe(callback, *args)
+        return True
+    except RuntimeError:
+        return False
+
+
+def _set_debug(loop, debug, slow_callback_duration):
+    loop.set_debug(debug)
+    loop.slow_callback_duration = slow_callback_duration
+
+
+def _instrument_loop(loop, slow_callback_duration):
+    """ debug mode on for the first session on the loop"""
+    with _lock:
+        entry = _instrumented.get(loop)
+        if entry is None:
+            entry = _instrumented[loop] = [0, loop.get_debug(), loop.slow_callback_duration]
+            _call_in_loop(loop, _set_debug, loop, True, slow_callback_duration)
+        entry[0] += 1
+
+
+def _release_loop(loop):
+    """ the last session on the loop puts debug mode and slow_callback_duration back"""
+    with _lock:
+        entry = _instrumented[loop]
+        entry[0] -= 1
+        if entry[0] == 0:
+            del _instrumented[loop]
+            _call_in_loop(loop, _set_debug, loop, entry[1], entry[2])
+
+
+def _imports_in_loop(loop):
+    with _lock:
+        return set(_loop_imports.get(loop, ()))
+
+
+async def watch_profile_requests(config, fetch_id):
+    """ run in the import's event loop, start the profiles requested for it in the profile index"""
+    fetch_id = str(fetch_id)
+    es = ElasticSearch(config["profile_es_config"])
+    loop = asyncio.get_event_loop()
+    thread_id = threading.get_ident()
+    seen = set()
+
+    with _lock:
+        _loop_imports.setdefault(loop, set()).add(fetch_id)
+    try:
+        while True:
+            await asyncio.sleep(config["poll_interval"])
+            try:
+                result = await loop.run_in_executor(None, es.search, _profiles_query(fetch_id, ["REQUESTED"]))
+            except Exception as e:
+                logger.error(f"profile request check for {fetch_id} failed: {repr(e)}")
+                continue
+
+            for hit in result["hits"]["hits"]:
+                if hit["_id"] not in seen:
+                    seen.add(hit["_id"])
+                    ProfileSession(config, hit["_source"], fetch_id, thread_id, loop).start()
+    finally:
+        with _lock:
+            _loop_imports[loop].discard(fetch_id)
+            if not _loop_imports[loop]:
+                del _loop_imports[loop]
+
+
+class _SlowCallbackHandler(logging.Handler):
+    """ collect asyncio debug mode 'Executing <Handle> took x seconds' warnings from the profiled thread"""
+
+    def __init__(self, profile):
+        super().__init__(logging.WARNING)
+        self.profile = profile
+
+    def emit(self, record):
+        if record.thread == self.profile.thread_id and record.getMessage().startswith("Executing"):
+            self.profile.slow_callbacks.append({
+                "timestamp": datetime.utcfromtimestamp(record.created).isoformat(timespec='milliseconds'),
+                "message": record.getMessage()
+            })
+
+
+class ProfileSession:
+    """
+    Sampling profile of one import's event loop.
+
+    A sampler thread records the Python stack of the import thread as folded stacks, loadable by flamegraph.pl,
+    inferno or speedscope. In the import's loop asyncio debug mode reports slow callbacks, and a timer callback
+    measures event loop lag, how late it runs, and counts the pending tasks by coroutine. The result is written
+    to the profile doc. The thread and loop can be shared with other imports (work_queue_concurrency > 1), the
+    report lists them in shared_loop_with; debug mode is reference counted across sessions on the same loop.
+    """
+
+    LAG_INTERVAL = 0.1
+
+    def __init__(self, config, request, fetch_id, thread_id, loop):
+        self.config = config
+        self.profile_id = request["profile_id"]
+        self.fetch_id = fetch_id
+        self.duration = min(request["duration"], config["max_duration"])
+        self.interval = max(request["interval"], MIN_INTERVAL)
+        self.thread_id = thread_id
+        self.loop = loop
+        self.es = ElasticSearch(config["profile_es_config"])
+
+        self.samples = 0
+        self.stacks = Counter()
+        self.lag = []
+        self.pending_tasks = Counter()
+        self.slow_callbacks = []
+        # other imports seen running in the same loop, they show up in the stacks, lag and slow callbacks too
+        self.shared_with = set()
+        self._stopped = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _schedule_tick(self):
+        # timer callbacks rather than a task, so nothing is left pending when the import's loop closes
+        when = self.loop.time() + self.LAG_INTERVAL
+        self.loop.call_at(when, self._tick, when)
+
+    def _tick(self, when):
+        self.lag.append(max(0.0, self.loop.time() - when))
+        for task in asyncio.all_tasks(self.loop):
+            coro = task.get_coro()
+            self.pending_tasks[getattr(coro, "__qualname__", repr(coro))] += 1
+        if not self._stopped.is_set():
+            self._schedule_tick()
+
+    def _sample(self):
+        """ False once the import thread is gone"""
+        frame = sys._current_frames().get(self.thread_id)
+        if frame is None:
+            return False
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{os.path.basename(code.co_filename)}:{getattr(code, 'co_qualname', code.co_name)}")
+            frame = frame.f_back
+        self.stacks[";".join([f"fetch_id {self.fetch_id}"] + stack[::-1])] += 1
+        self.samples += 1
+        return True
+
+    def _run(self):
+        doc = {"state": "FAIL"}
+        try:
+            self.es.update({"state": "RUNNING", "start_timestamp": datetime.utcnow().isoformat(timespec='seconds'),
+                            "worker": f"{socket.gethostname()}-{os.getpid()}"}, self.profile_id)
+            doc = self._profile()
+        except Exception as e:
+            logger.error(f"profile {self.profile_id} failed: {repr(e)}")
+        finally:
+            # always leave the profile doc in a final state
+            doc["end_timestamp"] = datetime.utcnow().isoformat(timespec='seconds')
+            try:
+                self.es.update(doc, self.profile_id)
+                logger.info(f"profile {self.profile_id} of {self.fetch_id} {doc['state']}")
+            except Exception as e:
+                logger.error(f"could not store profile {self.profile_id}: {repr(e)}")
+
+    def _profile(self):
+        handler = _SlowCallbackHandler(self)
+        logging.getLogger("asyncio").addHandler(handler)
+        _instrument_loop(self.loop, self.config["slow_callback_ms"] / 1000)
+        try:
+            _call_in_loop(self.loop, self._schedule_tick)
+            end = time.monotonic() + self.duration
+            while time.monotonic() < end and not self.loop.is_closed() and self._sample():
+                self.shared_with |= _imports_in_loop(self.loop) - {self.fetch_id}
+                time.sleep(self.interval)
+            return {"state": "DONE", "report": self.report(), "folded": self.folded()}
+        finally:
+            self._stopped.set()
+            logging.getLogger("asyncio").removeHandler(handler)
+            _release_loop(self.loop)
+
+    def folded(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.items())
+
+    def report(self):
+        lag = sorted(self.lag)
+        return {
+            "samples": self.samples,
+            "shared_loop_with": sorted(self.shared_with),
+            "event_loop_lag": {
+                "samples": len(lag),
+                "mean_ms": round(sum(lag) / len(lag) * 1000, 3) if lag else None,
+                "p99_ms": round(lag[int(len(lag) * 0.99)] * 1000, 3) if lag else None,
+                "max_ms": round(lag[-1] * 1000, 3) if lag else None
+            },
+            "slow_callbacks": self.slow_callbacks[-100:],
+            # a list, coroutine names as keys would each become a field in the index mapping
+            "pending_tasks": [{"coroutine": coroutine, "count": count}
+                              for coroutine, count in self.pending_tasks.most_common(10)]
+        }
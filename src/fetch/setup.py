@@ -6,27 +6,41 @@ from aiohttp import web
 from aiohttp_wsgi import WSGIHandler
 
 
-def flask_setup(log_level, app_name):
+def log_handler(log_level):
     import logging
-    import sys
-
-    import flask
-    from flask.logging import default_handler
 
     log_format = logging.Formatter('%(asctime)s - %(module)s - %(funcName)s - %(lineno)d - %(levelname)s - %(message)s',
                                    datefmt='%m/%d/%Y %H:%M:%S')
     handler = logging.StreamHandler(sys.stdout)
     handler.setFormatter(log_format)
     handler.setLevel(getattr(logging, log_level))
+    return handler
+
+
+def flask_setup(log_level, app_name):
+    import logging
+
+    import flask
+    from flask.logging import default_handler
 
     app = flask.Flask(app_name)
-    app.logger.addHandler(handler)
+    app.logger.addHandler(log_handler(log_level))
     app.logger.setLevel(logging.DEBUG)
     app.logger.removeHandler(default_handler)
 
     return app
 
 
+def worker_setup(log_level, logger_name="flask.app"):
+    """ logging for processes without a flask app, the "flask.app.*" loggers propagate to logger_name"""
+    import logging
+
+    logger = logging.getLogger(logger_name)
+    logger.addHandler(log_handler(log_level))
+    logger.setLevel(logging.DEBUG)
+    return logger
+
+
 def run_cycle(cycle):
     if sys.platform == 'win32':
         loop = asyncio.ProactorEventLoop()
@@ -0,0 +1,154 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+from copy import deepcopy
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+from elasticsearch.exceptions import ConflictError
+
+from .connectors.elasticsearch import ElasticSearch
+from .fetch_config import BaseConfig
+from .import_cycle import FetchStatus
+
+logger = logging.getLogger("flask.app.work_queue")
+
+
+def build_work_queue_config(enabled, lease_seconds, poll_interval, concurrency, max_attempts):
+    return {
+        "enabled": enabled,
+        "lease_seconds": lease_seconds,
+        "poll_interval": poll_interval,
+        "concurrency": concurrency,
+        "max_attempts": max_attempts
+    }
+
+
+class WorkQueue:
+    """
+    Imports queued as status docs in the status index.
+
+    A worker claims a QUEUED import, or a RUNNING one whose lease has expired, by writing its worker_id and
+    lease_expires with a conditional update, so only one worker wins. The lease is renewed while the import
+    runs; an import whose worker died is taken over by another worker once the lease runs out, up to
+    max_attempts claims, after that it is failed.
+    """
+
+    RENEW_ATTEMPTS = 3
+
+    def __init__(self, config: BaseConfig, worker_id=None):
+        self.config = config
+        self.lease_seconds = config.work_queue_config["lease_seconds"]
+        self.max_attempts = config.work_queue_config["max_attempts"]
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.es = ElasticSearch(config.base_es_config)
+
+    def _lease(self):
+        return {
+            "worker_id": self.worker_id,
+            "lease_expires": (datetime.utcnow() + timedelta(seconds=self.lease_seconds)).isoformat(timespec='seconds')
+        }
+
+    def enqueue(self, import_type, tenant_id):
+        """ queue an import for any worker to pick up, return its fetch_id"""
+        status_doc = deepcopy(self.config.STATUS_DOC)
+        fetch_id = status_doc["fetch_id"] = uuid4()
+        status_doc["status"] = FetchStatus.QUEUED.name
+        status_doc["tenant_id"] = tenant_id
+        status_doc["import_type"] = import_type
+        status_doc["start_timestamp"] = datetime.utcnow().isoformat(timespec='seconds')
+        self.es.insert(status_doc, fetch_id)
+        return fetch_id
+
+    def claim(self, import_type):
+        """ take the oldest available import, return its status doc or None when there is no work"""
+        result = self.es.search({
+            "size": 10,
+            "seq_no_primary_term": True,
+            "sort": [{"start_timestamp": "asc"}],
+            "query": {"bool": {
+                "filter": [{"match": {"import_type": import_type}}],
+                "should": [
+                    {"match": {"status": FetchStatus.QUEUED.name}},
+                    {"bool": {"filter": [{"match": {"status": FetchStatus.RUNNING.name}},
+                                         {"range": {"lease_expires": {"lt": "now"}}}]}}
+                ],
+                "minimum_should_match": 1
+            }}
+        })
+
+        for hit in result["hits"]["hits"]:
+            attempts = hit["_source"].get("attempts") or 0
+            if attempts >= self.max_attempts:
+                self._abandon(hit, attempts)
+                continue
+
+            claim = {**self._lease(), "status": FetchStatus.RUNNING.name, "attempts": attempts + 1}
+            try:
+                self.es.update(claim, hit["_id"], seq_no=hit["_seq_no"], primary_term=hit["_primary_term"])
+            except ConflictError:
+                # another worker got there first
+                continue
+
+            if hit["_source"]["status"] == FetchStatus.RUNNING.name:
+                logger.warning(f"taking over abandoned import {hit['_id']} from {hit['_source']['worker_id']}")
+            logger.info(f"{self.worker_id} claimed import {hit['_id']}")
+            return {**hit["_source"], **claim}
+
+        return None
+
+    def _abandon(self, hit, attempts):
+        """ fail an import that did not finish in max_attempts claims, it likely kills its worker"""
+        error = f"import abandoned after {attempts} attempts, last worker {hit['_source']['worker_id']}"
+        logger.error(f"{hit['_id']}: {error}")
+        try:
+            self.es.update({"status": FetchStatus.FAIL.name, "error": error,
+                            "end_timestamp": datetime.utcnow().isoformat(timespec='seconds')},
+                           hit["_id"], seq_no=hit["_seq_no"], primary_term=hit["_primary_term"])
+        except ConflictError:
+            pass
+
+    def renew(self, fetch_id):
+        """
+        extend the lease, False if the import is no longer ours. A conflict from an unrelated write to the status
+        doc is retried, ConflictError is raised if that keeps happening
+        """
+        for attempt in range(self.RENEW_ATTEMPTS):
+            result = self.es.get(fetch_id)
+            if result is None or result["_source"]["worker_id"] != self.worker_id \
+                    or result["_source"]["status"] != FetchStatus.RUNNING.name:
+                return False
+
+            try:
+                self.es.update(self._lease(), fetch_id, seq_no=result["_seq_no"],
+                               primary_term=result["_primary_term"])
+                return True
+            except ConflictError:
+                if attempt == self.RENEW_ATTEMPTS - 1:
+                    raise
+                logger.debug(f"status doc {fetch_id} changed under the lease renewal, retrying")
+
+    async def keep_alive(self, fetch_id):
+        """
+        renew the lease until it is lost, run alongside the import. Errors, e.g. an ES outage, are retried until
+        the lease we hold has actually expired
+        """
+        expires = time.monotonic() + self.lease_seconds
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                if not self.renew(fetch_id):
+                    logger.warning(f"{self.worker_id} lost the lease on import {fetch_id}")
+                    return
+                expires = time.monotonic() + self.lease_seconds
+            except Exception as e:
+                if time.monotonic() >= expires:
+                    logger.error(f"{self.worker_id} could not renew the lease on import {fetch_id}: {repr(e)}")
+                    return
+                logger.warning(f"lease renewal for import {fetch_id} failed, retrying: {repr(e)}")
+
+    def fail(self, fetch_id, error):
+        self.es.update({"status": FetchStatus.FAIL.name, "error": error,
+                        "end_timestamp": datetime.utcnow().isoformat(timespec='seconds')}, fetch_id)
@@ -1,28 +1,19 @@
 import asyncio
-import base64
-import hashlib
-import json
 import logging
 import sys
 import time
 import traceback
-from copy import deepcopy
-from functools import partial
-from os import wait
 from threading import Thread
-from uuid import uuid4, UUID
-from xml.etree import ElementTree
 
-import aiohttp
-from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
-from flask import jsonify
+from flask import jsonify, request, Response
 
 from config import Config
-from fetch import flask_setup, ImportCycle
+from fetch import flask_setup, WorkQueue
 from fetch.connectors.elasticsearch import ElasticSearch
-from fetch.fetch_config import get_bearer_token
+from fetch.import_cycle import FetchStatus
+from fetch.profiling import request_profile, get_profile, ProfileError
 from fetch.setup import make_aiohttp_app
+from vehicle_import import run_vehicle_import
 
 config = Config()
 app = flask_setup(config.v['log_level'], config.APP_NAME)
@@ -60,30 +51,18 @@ def not_found(e):
 def import_vehicle(tenant_id):
     cycle = None
 
-    async def run():
-        b_token = f"Bearer {get_bearer_token(config.auth_config)['accessToken']}"
-
-        vqwc = deepcopy(config.vehicle_query_wsapi_config)
-        vqwc["header"]["Authorization"] = b_token
-        logger.debug(vqwc)
-
-        es = ElasticSearch(config.es_raw_config)
-
-        tsc = deepcopy(config.tenant_service_config)
-        tsc["header"]["Authorization"] = b_token
-
-        async with aiohttp.ClientSession() as session:
-            get_ = partial(get, tenant_id, tsc, config.v['app_config.key'])
-            store_ = partial(store, vqwc, session, es)
-
-            nonlocal cycle
-            cycle = ImportCycle("vehicle", tenant_id, config, get_, store_, notify)
-
-            await cycle.run()
+    def started(cycle_):
+        nonlocal cycle
+        cycle = cycle_
 
     try:
+        if config.work_queue_config["enabled"]:
+            fetch_id = WorkQueue(config).enqueue("vehicle", tenant_id)
+            return jsonify({"serviceCode": None, "serviceMessage": None,
+                            "content": {"fetch_id": fetch_id, "Status": FetchStatus.QUEUED.name}})
+
         def run_loop(loop):
-            loop.run_until_complete(run())
+            loop.run_until_complete(run_vehicle_import(config, tenant_id, started=started))
             loop.close()
 
         loop = asyncio.new_event_loop()
@@ -106,10 +85,10 @@ def import_vehicle(tenant_id):
 def status(fetch_id):
     app.logger.info(f"get status for fetch_id: {fetch_id}")
     es = ElasticSearch(config.base_es_config)
-    result = es.get(fetch_id)
-    app.logger.debug(result)
 
     try:
+        result = es.get(fetch_id)
+        app.logger.debug(result)
         if result is None or result["found"] is not True:
             return jsonify({"serviceCode": 1030,
                             "serviceMessage": "fetch_id {fetch_id} not found"}), 404
@@ -123,132 +102,77 @@ def status(fetch_id):
                         "serviceMessage": "Critical Error, FAILURE"}), 500
 
 
-async def make_vehicle(xml, customer_id, tenant_id):
+@app.route("/admin/profile", methods=["POST"])
+def profile_start():
     """
-    vehicle is our json object to load
+    profile the import given by the fetch_id arg, or every running import, for duration seconds
+    the process running each import picks the request up from its status doc
     """
+    fetch_id = request.args.get("fetch_id")
+    try:
+        duration = float(request.args.get("duration", 30))
+        interval = float(request.args.get("interval", 0.005))
+    except ValueError as e:
+        return jsonify({"serviceCode": 1020, "serviceMessage": f"Bad Request, {e}"}), 400
 
-    # INTERNAL MODEL
-    vehicle = {
-        "vin": None,
-        "licensenumber": None,
-        "busNumber": None,
-        "deviceId": None,
-        "manufacturer": None,
-        "model": "unknown",
-        "tenantId": None,
-        "assetId": None,
-        "customerId": None,
-        "deviceModel": "zonar",
-        "deviceBrand": "zonar",
-        "RecordStatus": None
-    }
-
-    # CLIENT MAPPING
-    zonar_mapping = {
-        "vin": "vin",
-        "name": "licensenumber",
-        "exsid": "busNumber",
-        "mfg": "manufacturer",
-        "opstatus": "status",
-        "gps": "deviceId",
-        "status": "zonarRecordStatus"
-    }
-
-    assets = ElementTree.fromstring(xml)
-    if assets.tag == "assetlist":
-        for asset in assets:
-            curr = deepcopy(vehicle)
-            curr["assetId"] = asset.attrib["id"]
-            curr["customerId"] = customer_id
-            curr["tenantId"] = tenant_id
-            for elem in asset:
-                if elem.tag in zonar_mapping:
-                    curr[zonar_mapping[elem.tag]] = elem.text
-            yield curr
-
-
-async def get_vehicle_info(tenant_id, session, tsc, key):
-    async with session.get(f"{tsc['gateway_url']}/{str(tenant_id)}", headers=tsc["header"]) as response:
-        data = await response.json()
-
-        if response.status != 200 or data["serviceCode"] or data["content"] is None:
-            raise Exception("could not get tenant data", data)
-
-    key = bytearray(key, 'UTF-8')
-    sha1 = hashlib.sha1()
-    sha1.update(key)
-    key = sha1.digest()[:16]
-    cipher = Cipher(algorithms.AES(key), modes.ECB(), backend=default_backend())
-
-    customers = []
-    for record in data["content"]["Integrations"]:
-        decrypt = cipher.decryptor()
-        password = decrypt.update(base64.b64decode(bytearray(record["Password"], 'UTF-8')))
-        password += decrypt.finalize()
-        password = password.decode('UTF-8')
-        password = password.strip('x\03')
-
-        result = {
-            "customer_id": record["CustomerId"],
-            "host_name": record["HostName"],
-            "password": password,
-            "username": record["Username"],
-        }
-        customers.append(result)
-
-    return customers
-
-
-async def get(tenant_id, tsc, key):
-    async with aiohttp.ClientSession() as session:
-        customers = await get_vehicle_info(tenant_id, session, tsc, key)
-        for customer in customers:
-            params = {"operation": "showassets", "format": "xml", "action": "showopen",
-                      "customer": customer["customer_id"]}
-            auth = aiohttp.BasicAuth(customer["username"], customer["password"])
-            logger.debug(f"get next customer {customer['host_name']} {params}")
-
-            async with session.get(f"{customer['host_name']}/interface.php", auth=auth, params=params) as resp:
-                xml = await resp.text()
-
-            logger.log(1, f"xml from {customer['customer_id']}, {xml}")
-            async for data in make_vehicle(xml, customer["customer_id"], tenant_id):
-                yield data, 1
-
-
-async def store(vqwc, session, es, data, fetch_id):
-    class UUIDEncoder(json.JSONEncoder):
-        def default(self, obj):
-            if isinstance(obj, UUID):
-                # if the obj is uuid, we simply return the value of uuid
-                return str(obj)
-            return json.JSONEncoder.default(self, obj)
-
-    # store raw data with fetch id and then remove
-    data['fetch_id'] = fetch_id
+    try:
+        if fetch_id is not None:
+            fetch_ids = [fetch_id]
+        else:
+            es = ElasticSearch(config.base_es_config)
+            result = es.search({"size": 1000, "_source": False,
+                                "query": {"match": {"status": FetchStatus.RUNNING.name}}})
+            fetch_ids = [hit["_id"] for hit in result["hits"]["hits"]]
+
+        profiles = []
+        for fetch_id_ in fetch_ids:
+            try:
+                profile_id = request_profile(config.profile_config, fetch_id_, duration, interval)
+                profiles.append({"fetch_id": fetch_id_, "profile_id": profile_id})
+            except ProfileError as e:
+                if fetch_id is not None:
+                    return jsonify({"serviceCode": 1020, "serviceMessage": f"Bad Request, {e}"}), 400
+                logger.info(f"skipping {fetch_id_}: {e}")
+
+        return jsonify({"serviceCode": None, "serviceMessage": None, "content": profiles}), 202
+    except Exception:
+        error = repr(traceback.format_exception(*sys.exc_info()))
+        logger.error(error)
+        return jsonify({"serviceCode": 1050,
+                        "serviceMessage": "Critical Error, FAILURE"}), 500
 
-    # store raw data
-    es.insert(data, uuid4())
-    del data['fetch_id']
 
+@app.route("/admin/profile/<uuid:profile_id>")
+def profile_status(profile_id):
     try:
-        async with session.put(vqwc["gateway_url"], data=json.dumps(data, cls=UUIDEncoder),
-                               headers=vqwc["header"]) as response:
-            body = await response.text()
-            logger.debug(f"vehicleQueryWSAPI status: {response.status} response: {response.__dict__}")
-            # 400 is for bad data, that should not halt the import
-            if response.status not in (200, 400):
-                raise Exception(f'bad reponse: {response.status}, {body}')
-            return {'status': response.status, 'body': body}
-    except (OSError, RuntimeError) as e:
+        profile = get_profile(config.profile_config, profile_id)
+        if profile is None:
+            return jsonify({"serviceCode": 1030, "serviceMessage": f"profile_id {profile_id} not found"}), 404
+        profile.pop("folded", None)
+        return jsonify({"serviceCode": None, "serviceMessage": None, "content": profile}), 200
+    except Exception:
         error = repr(traceback.format_exception(*sys.exc_info()))
         logger.error(error)
-        raise e
+        return jsonify({"serviceCode": 1050,
+                        "serviceMessage": "Critical Error, FAILURE"}), 500
 
 
-async def notify(status):
-    pass
+@app.route("/admin/profile/<uuid:profile_id>/flamegraph")
+def profile_flamegraph(profile_id):
+    """ folded stacks, feed to flamegraph.pl or load in speedscope"""
+    try:
+        profile = get_profile(config.profile_config, profile_id)
+        if profile is None:
+            return jsonify({"serviceCode": 1030, "serviceMessage": f"profile_id {profile_id} not found"}), 404
+        if profile["state"] != "DONE":
+            return jsonify({"serviceCode": 1060, "serviceMessage": f"profile {profile['state']}"}), 409
+        return Response(profile["folded"], mimetype="text/plain",
+                        headers={"Content-Disposition": f"attachment; filename={profile_id}.folded"})
+    except Exception:
+        error = repr(traceback.format_exception(*sys.exc_info()))
+        logger.error(error)
+        return jsonify({"serviceCode": 1050,
+                        "serviceMessage": "Critical Error, FAILURE"}), 500
 
 
 if __name__ == '__main__':
@@ -0,0 +1,150 @@
+"""
+The vehicle import, shared by the api (main.py) and the work queue workers (worker.py).
+"""
+import base64
+import hashlib
+import json
+import logging
+import sys
+import traceback
+from copy import deepcopy
+from functools import partial
+from uuid import uuid4, UUID
+
+import aiohttp
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+from fetch import ImportCycle
+from fetch.connectors.elasticsearch import ElasticSearch
+from fetch.connectors.eureka import get_discovery_client
+from fetch.fetch_config import get_bearer_token
+from fetch.mapping import compile_mapping
+from vendor_mappings import ZONAR_MAPPING
+
+logger = logging.getLogger("flask.app.vehicle_import")
+
+zonar_mapping = compile_mapping(ZONAR_MAPPING)
+
+
+async def run_vehicle_import(config, tenant_id, status_doc=None, started=None):
+    """
+    run a vehicle import, status_doc is set when the import was claimed from the work queue
+    started is called with the ImportCycle once it exists
+    """
+    b_token = f"Bearer {get_bearer_token(config.auth_config)['accessToken']}"
+
+    vqwc = deepcopy(config.vehicle_query_wsapi_config)
+    vqwc["header"]["Authorization"] = b_token
+    logger.debug(vqwc)
+
+    es = ElasticSearch(config.es_raw_config)
+    if status_doc is not None and (status_doc.get("attempts") or 0) > 1:
+        # taken over from a worker that died part way, the import starts over so drop its raw docs
+        logger.info(f"removing raw docs of the previous attempt at {status_doc['fetch_id']}")
+        es.delete_by_query({"query": {"match_phrase": {"fetch_id": str(status_doc["fetch_id"])}}})
+
+    tsc = deepcopy(config.tenant_service_config)
+    tsc["header"]["Authorization"] = b_token
+
+    discovery = get_discovery_client(config.vehicle_query_wsapi_discovery_config)
+
+    async with aiohttp.ClientSession() as session:
+        get_ = partial(get, tenant_id, tsc, config.v['app_config.key'])
+        store_ = partial(store, vqwc, session, es, discovery)
+
+        cycle = ImportCycle("vehicle", tenant_id, config, get_, store_, notify, status_doc)
+        if started is not None:
+            started(cycle)
+
+        return await cycle.run()
+
+
+async def make_vehicle(xml, customer_id, tenant_id):
+    """
+    vehicle is our json object to load
+    """
+    for vehicle in zonar_mapping.records(xml, {"customer_id": customer_id, "tenant_id": tenant_id}):
+        yield vehicle
+
+
+async def get_vehicle_info(tenant_id, session, tsc, key):
+    async with session.get(f"{tsc['gateway_url']}/{str(tenant_id)}", headers=tsc["header"]) as response:
+        data = await response.json()
+
+        if response.status != 200 or data["serviceCode"] or data["content"] is None:
+            raise Exception("could not get tenant data", data)
+
+    key = bytearray(key, 'UTF-8')
+    sha1 = hashlib.sha1()
+    sha1.update(key)
+    key = sha1.digest()[:16]
+    cipher = Cipher(algorithms.AES(key), modes.ECB(), backend=default_backend())
+
+    customers = []
+    for record in data["content"]["Integrations"]:
+        decrypt = cipher.decryptor()
+        password = decrypt.update(base64.b64decode(bytearray(record["Password"], 'UTF-8')))
+        password += decrypt.finalize()
+        password = password.decode('UTF-8')
+        password = password.strip('x\03')
+
+        result = {
+            "customer_id": record["CustomerId"],
+            "host_name": record["HostName"],
+            "password": password,
+            "username": record["Username"],
+        }
+        customers.append(result)
+
+    return customers
+
+
+async def get(tenant_id, tsc, key):
+    async with aiohttp.ClientSession() as session:
+        customers = await get_vehicle_info(tenant_id, session, tsc, key)
+        for customer in customers:
+            params = {"operation": "showassets", "format": "xml", "action": "showopen",
+                      "customer": customer["customer_id"]}
+            auth = aiohttp.BasicAuth(customer["username"], customer["password"])
+            logger.debug(f"get next customer {customer['host_name']} {params}")
+
+            async with session.get(f"{customer['host_name']}/interface.php", auth=auth, params=params) as resp:
+                xml = await resp.text()
+
+            logger.log(1, f"xml from {customer['customer_id']}, {xml}")
+            async for data in make_vehicle(xml, customer["customer_id"], tenant_id):
+                yield data, 1
+
+
+async def store(vqwc, session, es, discovery, data, fetch_id):
+    class UUIDEncoder(json.JSONEncoder):
+        def default(self, obj):
+            if isinstance(obj, UUID):
+                # if the obj is uuid, we simply return the value of uuid
+                return str(obj)
+            return json.JSONEncoder.default(self, obj)
+
+    # store raw data with fetch id and then remove
+    data['fetch_id'] = fetch_id
+
+    # store raw data
+    es.insert(data, uuid4())
+    del data['fetch_id']
+
+    try:
+        url, status, body = await discovery.request(session, "PUT", vqwc["gateway_url"],
+                                                    data=json.dumps(data, cls=UUIDEncoder), headers=vqwc["header"])
+        logger.debug(f"vehicleQueryWSAPI {url} status: {status} response: {body}")
+        # 400 is for bad data, that should not halt the import
+        if status not in (200, 400):
+            raise Exception(f'bad reponse: {status}, {body}')
+        return {'status': status, 'body': body}
+    except (OSError, RuntimeError) as e:
+        error = repr(traceback.format_exception(*sys.exc_info()))
+        logger.error(error)
+        raise e
+
+
+async def notify(status):
+    pass
@@ -0,0 +1,26 @@
+"""
+Telematics vendor to internal vehicle model mappings, see fetch.mapping.compile_mapping for the spec format.
+"""
+
+ZONAR_MAPPING = {
+    "root": "assetlist",
+    "fields": {
+        # INTERNAL MODEL
+        "vin": {"tag": "vin"},
+        "licensenumber": {"tag": "name"},
+        "busNumber": {"tag": "exsid"},
+        "deviceId": {"tag": "gps"},
+        "manufacturer": {"tag": "mfg"},
+        "model": {"default": "unknown"},
+        "tenantId": {"context": "tenant_id"},
+        # the PUT goes to the assetId endpoint, an asset without id halts the import as it always has
+        "assetId": {"attribute": "id", "required": True},
+        "customerId": {"context": "customer_id"},
+        "deviceModel": {"default": "zonar"},
+        "deviceBrand": {"default": "zonar"},
+        "RecordStatus": {},
+        # zonar only fields, left out when the tag is missing, None when it is empty
+        "status": {"tag": "opstatus", "optional": True},
+        "zonarRecordStatus": {"tag": "status", "optional": True}
+    }
+}
@@ -0,0 +1,90 @@
+"""
+Work queue worker, runs imports queued by the api when app_config.work_queue_enabled is set.
+
+Run any number of these on any node: python worker.py
+"""
+import asyncio
+import logging
+import sys
+import traceback
+from uuid import UUID
+
+from config import Config
+from fetch import WorkQueue, worker_setup
+from vehicle_import import run_vehicle_import
+
+logger = logging.getLogger("flask.app.worker")
+
+
+async def run_claimed(config, queue, status_doc):
+    """ run a claimed import while keeping its lease, stop if the lease is lost to another worker"""
+    fetch_id = status_doc["fetch_id"]
+    import_ = asyncio.ensure_future(run_vehicle_import(config, UUID(str(status_doc["tenant_id"])), status_doc))
+    lease = asyncio.ensure_future(queue.keep_alive(fetch_id))
+
+    done, _pending = await asyncio.wait({import_, lease}, return_when=asyncio.FIRST_COMPLETED)
+    if import_ not in done:
+        if lease.exception() is not None:
+            logger.error(f"lease task for import {fetch_id} failed: {repr(lease.exception())}")
+        # wait for the import to unwind, it cancels its pending stores
+        import_.cancel()
+        await asyncio.wait({import_})
+        return
+
+    lease.cancel()
+    if import_.exception() is not None:
+        logger.error(f"import {fetch_id} failed")
+        error = repr(traceback.format_exception(type(import_.exception()), import_.exception(),
+                                                import_.exception().__traceback__))
+        logger.error(error)
+        try:
+            queue.fail(fetch_id, error)
+        except Exception as e:
+            # the lease runs out and another worker retries it
+            logger.error(f"could not mark import {fetch_id} failed: {repr(e)}")
+
+
+async def work(config, queue, import_type):
+    concurrency = config.work_queue_config["concurrency"]
+    poll_interval = config.work_queue_config["poll_interval"]
+    running = set()
+
+    while True:
+        try:
+            while len(running) < concurrency:
+                status_doc = queue.claim(import_type)
+                if status_doc is None:
+                    break
+                running.add(asyncio.ensure_future(run_claimed(config, queue, status_doc)))
+        except Exception as e:
+            # keep the running imports going, back off and try again
+            logger.error(f"claim failed: {repr(e)}")
+            await asyncio.sleep(poll_interval)
+
+        if running:
+            done, running = await asyncio.wait(running, timeout=poll_interval, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    logger.error(f"run_claimed failed: {repr(task.exception())}")
+        else:
+            await asyncio.sleep(poll_interval)
+
+
+def main():
+    # workers serve no http, keep them out of eureka
+    config = Config(register=False)
+    worker_setup(config.v['log_level'])
+
+    queue = WorkQueue(config)
+    logger.info(f"worker {queue.worker_id} started")
+
+    if sys.platform == 'win32':
+        loop = asyncio.ProactorEventLoop()
+    else:
+        loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    loop.run_until_complete(work(config, queue, "vehicle"))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the app runs from inside src (see Dockerfile), import it the same way
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
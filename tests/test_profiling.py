@@ -0,0 +1,108 @@
+import asyncio
+import threading
+import time
+from unittest import mock
+
+import pytest
+
+from fetch import profiling
+from fetch.profiling import ProfileSession, build_profile_config
+
+SLOW_CALLBACK_MS = 20
+
+
+@pytest.fixture
+def config():
+    return build_profile_config(status_es_config={"index": "status"}, profile_es_config={"index": "profile"},
+                                poll_interval=0.05, max_duration=5, slow_callback_ms=SLOW_CALLBACK_MS,
+                                retention_days=7)
+
+
+@pytest.fixture
+def es():
+    with mock.patch.object(profiling, "ElasticSearch") as es_class:
+        yield es_class.return_value
+
+
+def run_loop(coro):
+    """ run coro in its own thread and loop, like an import, return the loop and thread"""
+    loop = asyncio.new_event_loop()
+
+    def run():
+        loop.run_until_complete(coro(loop))
+        loop.close()
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return loop, thread
+
+
+def final_doc(es, profile_id):
+    return [call.args[0] for call in es.update.call_args_list if call.args[1] == profile_id][-1]
+
+
+def test_overlapping_sessions_restore_loop_settings(config, es):
+    started = threading.Event()
+    settings = {}
+
+    async def import_(loop):
+        loop.slow_callback_duration = 0.5
+        started.set()
+        for _ in range(40):
+            time.sleep(0.01)
+            await asyncio.sleep(0.01)
+        # both sessions are over, the settings from before are back
+        await asyncio.sleep(0.2)
+        settings.update(debug=loop.get_debug(), slow_callback_duration=loop.slow_callback_duration)
+
+    loop, thread = run_loop(import_)
+    started.wait()
+    thread_id = thread.ident
+    first = ProfileSession(config, {"profile_id": "p1", "duration": 0.3, "interval": 0}, "f1", thread_id, loop)
+    second = ProfileSession(config, {"profile_id": "p2", "duration": 0.15, "interval": 0}, "f1", thread_id, loop)
+    first.start()
+    second.start()
+    thread.join()
+
+    assert settings == {"debug": False, "slow_callback_duration": 0.5}
+    assert final_doc(es, "p1")["state"] == "DONE"
+    assert final_doc(es, "p2")["state"] == "DONE"
+    assert first.interval == profiling.MIN_INTERVAL
+
+
+def test_report_lists_imports_sharing_the_loop(config, es):
+    started = threading.Event()
+
+    async def import_(loop):
+        profiling._loop_imports[loop] = {"f1", "f2"}
+        started.set()
+        await asyncio.sleep(0.3)
+        del profiling._loop_imports[loop]
+
+    loop, thread = run_loop(import_)
+    started.wait()
+    session = ProfileSession(config, {"profile_id": "p1", "duration": 0.2, "interval": 0.01}, "f1", thread.ident,
+                             loop)
+    session.start()
+    thread.join()
+    time.sleep(0.1)
+
+    assert final_doc(es, "p1")["report"]["shared_loop_with"] == ["f2"]
+
+
+def test_profile_doc_final_when_loop_closes(config, es):
+    async def import_(loop):
+        await asyncio.sleep(0.05)
+
+    loop, thread = run_loop(import_)
+    session = ProfileSession(config, {"profile_id": "p1", "duration": 2, "interval": 0.01}, "f1", thread.ident, loop)
+    session.start()
+    thread.join()
+    deadline = time.monotonic() + 2
+    while not any(call.args[0].get("end_timestamp") for call in es.update.call_args_list) \
+            and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+    assert final_doc(es, "p1")["state"] in ("DONE", "FAIL")
+    assert "end_timestamp" in final_doc(es, "p1")
+    assert profiling._instrumented == {}
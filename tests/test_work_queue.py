@@ -0,0 +1,89 @@
+import asyncio
+import time
+from types import SimpleNamespace
+from unittest import mock
+
+import pytest
+from elasticsearch.exceptions import ConflictError, ConnectionError, NotFoundError
+
+from fetch import BaseConfig, WorkQueue
+from fetch.connectors.elasticsearch import ElasticSearch, build_es_config
+from fetch.work_queue import build_work_queue_config
+
+LEASE_SECONDS = 0.3
+
+
+@pytest.fixture
+def queue():
+    config = SimpleNamespace(
+        STATUS_DOC=BaseConfig.STATUS_DOC,
+        base_es_config=build_es_config(index="status", url="localhost", port=9200, username="u", password="p"),
+        work_queue_config=build_work_queue_config(enabled=True, lease_seconds=LEASE_SECONDS, poll_interval=1,
+                                                  concurrency=1, max_attempts=3)
+    )
+    queue = WorkQueue(config, worker_id="worker-1")
+    queue.es.conn = mock.Mock()
+    return queue
+
+
+def status_doc(worker_id="worker-1", status="RUNNING", seq_no=1):
+    return {"found": True, "_seq_no": seq_no, "_primary_term": 1,
+            "_source": {"worker_id": worker_id, "status": status}}
+
+
+def es_down():
+    return ConnectionError("N/A", "connection refused", Exception("connection refused"))
+
+
+def test_get_returns_none_when_not_found():
+    es = ElasticSearch(build_es_config(index="status", url="localhost", port=9200, username="u", password="p"))
+    es.conn = mock.Mock()
+    es.conn.get.side_effect = NotFoundError(404, "not found")
+    assert es.get("fetch-1") is None
+
+
+def test_get_raises_transport_errors():
+    es = ElasticSearch(build_es_config(index="status", url="localhost", port=9200, username="u", password="p"))
+    es.conn = mock.Mock()
+    es.conn.get.side_effect = es_down()
+    with pytest.raises(ConnectionError):
+        es.get("fetch-1")
+
+
+def test_renew_retries_conflict_from_unrelated_write(queue):
+    # e.g. a profile request written to the status doc between the get and the conditional update
+    queue.es.conn.get.side_effect = [status_doc(seq_no=1), status_doc(seq_no=2)]
+    queue.es.conn.update.side_effect = [ConflictError(409, "version_conflict"), {"result": "updated"}]
+
+    assert queue.renew("fetch-1") is True
+    assert queue.es.conn.update.call_args.kwargs["if_seq_no"] == 2
+
+
+def test_renew_lost_when_taken_over(queue):
+    queue.es.conn.get.side_effect = [status_doc(seq_no=1), status_doc(worker_id="worker-2", seq_no=2)]
+    queue.es.conn.update.side_effect = ConflictError(409, "version_conflict")
+
+    assert queue.renew("fetch-1") is False
+
+
+def test_keep_alive_survives_short_es_outage(queue):
+    queue.es.conn.get.side_effect = [es_down(), status_doc()] + [status_doc()] * 10
+
+    async def run():
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(queue.keep_alive("fetch-1"), LEASE_SECONDS * 2.5)
+
+    asyncio.run(run())
+    assert queue.es.conn.update.called
+
+
+def test_keep_alive_gives_up_once_lease_expired(queue):
+    queue.es.conn.get.side_effect = es_down()
+
+    async def run():
+        start = time.monotonic()
+        await asyncio.wait_for(queue.keep_alive("fetch-1"), LEASE_SECONDS * 5)
+        return time.monotonic() - start
+
+    assert asyncio.run(run()) >= LEASE_SECONDS
+    assert queue.es.conn.get.call_count > 1